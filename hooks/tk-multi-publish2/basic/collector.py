@@ -8,6 +8,7 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
+import logging
 import os
 import hou
 import sgtk
@@ -26,6 +27,116 @@ _HOUDINI_OUTPUTS = {
     },
 }
 
+# The outputs above flattened to (category, type, output file parm) tuples
+_HOUDINI_OUTPUTS_FLAT = [
+    (node_category, node_type, path_parm_name)
+    for node_category, node_types in _HOUDINI_OUTPUTS.items()
+    for node_type, path_parm_name in node_types.items()
+]
+
+# Node types whose regular collection is skipped when the matching tk nodes
+# were collected. Maps node type to the kind of tk node superseding it.
+_SKIP_IF_COLLECTED = {
+    "alembic": "alembic",
+    "ifd": "mantra",
+}
+
+# The tk node apps collected by HoudiniSessionCollector._collect_tk_nodes,
+# keyed by the kind added to the collected kinds. Each spec holds the app name,
+# the label used when logging, whether the output is a frame sequence, whether
+# the app's publish template should be set on the items, whether setting the
+# template properties (or failing to) should be logged and whether a missing
+# output should be warned about.
+_TK_NODE_SPECS = {
+    "alembic": {
+        "app": "tk-houdini-alembicnode",
+        "node_label": "sgtk_alembic",
+        "frame_sequence": False,
+        "set_publish_template": False,
+        "log_template_properties": False,
+        "warn_missing_output": False,
+    },
+    "mantra": {
+        "app": "tk-houdini-mantranode",
+        "node_label": "sgtk_mantra",
+        "frame_sequence": True,
+        "set_publish_template": False,
+        "log_template_properties": False,
+        "warn_missing_output": False,
+    },
+    "cache": {
+        "app": "tk-houdini-cachenode",
+        "node_label": "sgtk_cache",
+        "frame_sequence": True,
+        "set_publish_template": True,
+        "log_template_properties": True,
+        "warn_missing_output": True,
+    },
+}
+
+
+def _stat_or_none(path):
+    """
+    Stats the supplied path, returning None if it does not exist or is not a
+    valid path. Treats the same paths as missing as ``os.path.exists``.
+
+    :param str path: The path to stat.
+    :returns: :class:`os.stat_result` or None
+    """
+    try:
+        return os.stat(path)
+    except (OSError, ValueError):
+        return None
+
+
+def _exists_in_listing(path, listings):
+    """
+    Checks whether the supplied path is found in a listing of its parent
+    directory. Each directory is only listed once and cached in the supplied
+    dictionary, so checking many files sharing a directory costs a single
+    directory read instead of one stat per file.
+
+    A miss is not conclusive: on case-insensitive or unicode-normalizing file
+    systems (e.g. APFS/HFS+ on macOS, where ``os.path.normcase`` does nothing)
+    the listed name may differ from the supplied one. Callers should confirm
+    a miss with a stat.
+
+    :param str path: The file path to check.
+    :param dict listings: Cache of directory path to the set of its entries.
+    :returns: True if the file is listed, False otherwise.
+    """
+    dir_path, file_name = os.path.split(os.path.normcase(path))
+    entries = listings.get(dir_path)
+    if entries is None:
+        try:
+            entries = set(
+                os.path.normcase(entry) for entry in os.listdir(dir_path or os.curdir)
+            )
+        except (OSError, ValueError):
+            entries = set()
+        listings[dir_path] = entries
+    return file_name in entries
+
+
+class _Lazy(object):
+    """
+    Calls the wrapped function on first call and returns the cached result
+    afterwards. Used to defer template lookups until an item needs them.
+    """
+
+    __slots__ = ("_func", "_value", "_done")
+
+    def __init__(self, func):
+        self._func = func
+        self._value = None
+        self._done = False
+
+    def __call__(self):
+        if not self._done:
+            self._value = self._func()
+            self._done = True
+        return self._value
+
 
 class HoudiniSessionCollector(HookBaseClass):
     """
@@ -33,6 +144,13 @@ class HoudiniSessionCollector(HookBaseClass):
     the basic collector hook.
     """
 
+    def __init__(self, *args, **kwargs):
+        super(HoudiniSessionCollector, self).__init__(*args, **kwargs)
+
+        # set up the collection state so the collect methods can also be
+        # called on their own, outside of process_current_session
+        self._reset_collection_state()
+
     @property
     def settings(self):
         """
@@ -81,10 +199,8 @@ class HoudiniSessionCollector(HookBaseClass):
         # create an item representing the current houdini session
         item = self.collect_current_houdini_session(settings, parent_item)
 
-        # remember if we collect any alembic/mantra nodes
-        self._alembic_nodes_collected = False
-        self._mantra_nodes_collected = False
-        self._arnold_nodes_collected = False
+        # start every collection from a clean state
+        self._reset_collection_state()
 
         # methods to collect tk alembic/mantra/cache nodes if the app is installed
         self.collect_tk_alembicnodes(item)
@@ -149,52 +265,52 @@ class HoudiniSessionCollector(HookBaseClass):
         :param parent_item: Parent Item instance
         """
 
-        for node_category in _HOUDINI_OUTPUTS:
-            for node_type in _HOUDINI_OUTPUTS[node_category]:
+        # bind the base class method once rather than per collected node
+        collect_file = super(HoudiniSessionCollector, self)._collect_file
 
-                if node_type == "alembic" and self._alembic_nodes_collected:
-                    self.logger.debug(
-                        "Skipping regular alembic node collection since tk "
-                        "alembic nodes were collected. "
-                    )
-                    continue
+        for node_category, node_type, path_parm_name in _HOUDINI_OUTPUTS_FLAT:
 
-                if node_type == "ifd" and self._mantra_nodes_collected:
-                    self.logger.debug(
-                        "Skipping regular mantra node collection since tk "
-                        "mantra nodes were collected. "
-                    )
-                    continue
+            tk_kind = _SKIP_IF_COLLECTED.get(node_type)
+            if tk_kind in self._collected_kinds:
+                self.logger.debug(
+                    "Skipping regular %s node collection since tk "
+                    "%s nodes were collected. ",
+                    tk_kind,
+                    tk_kind,
+                )
+                continue
 
-                path_parm_name = _HOUDINI_OUTPUTS[node_category][node_type]
+            # the node type may not be available in this session
+            nt = hou.nodeType(node_category, node_type)
+            if nt is None:
+                continue
 
-                # get all the nodes for the category and type
-                nodes = hou.nodeType(node_category, node_type).instances()
+            # get all the nodes for the category and type
+            nodes = nt.instances()
+            if not nodes:
+                continue
 
-                # iterate over each node
-                for node in nodes:
+            # iterate over each node
+            for node in nodes:
 
-                    # get the evaluated path parm value
-                    path = node.parm(path_parm_name).eval()
+                # get the evaluated path parm value
+                path = node.evalParm(path_parm_name)
 
-                    # ensure the output path exists
-                    if not os.path.exists(path):
-                        continue
+                # ensure the output path exists
+                if not self._path_exists(path):
+                    continue
 
-                    self.logger.info(
-                        "Processing %s node: %s" % (node_type, node.path())
-                    )
+                node_path = node.path()
+                self.logger.info("Processing %s node: %s", node_type, node_path)
 
-                    # allow the base class to collect and create the item. it
-                    # should know how to handle the output path
-                    item = super(HoudiniSessionCollector, self)._collect_file(
-                        parent_item, path, frame_sequence=True
-                    )
+                # allow the base class to collect and create the item. it
+                # should know how to handle the output path
+                item = collect_file(parent_item, path, frame_sequence=True)
 
-                    # the item has been created. update the display name to
-                    # include the node path to make it clear to the user how it
-                    # was collected within the current session.
-                    item.name = "%s (%s)" % (item.name, node.path())
+                # the item has been created. update the display name to
+                # include the node path to make it clear to the user how it
+                # was collected within the current session.
+                item.name = "%s (%s)" % (item.name, node_path)
 
     def collect_tk_cachenodes(self, parent_item):
         """
@@ -203,69 +319,7 @@ class HoudiniSessionCollector(HookBaseClass):
         item for each one with an output on disk.
         :param parent_item: The item to parent new items to.
         """
-
-        publisher = self.parent
-        engine = publisher.engine
-
-        cachenode_app = engine.apps.get("tk-houdini-cachenode")
-        if not cachenode_app:
-            self.logger.debug(
-                "The tk-houdini-cachenode app is not installed. "
-                "Will not attempt to collect those nodes."
-            )
-            return
-
-        try:
-            tk_cache_nodes = cachenode_app.get_nodes()
-        except AttributeError:
-            self.logger.warning(
-                "Unable to query the session for tk-houdini-cachenode " "instances."
-            )
-            return
-
-        # retrieve the work file template defined by the app. we'll set this
-        # on the collected cachenode items for use during publishing.
-        work_template = cachenode_app.get_work_file_template()
-        publish_template = cachenode_app.get_publish_file_template()
-
-        for node in tk_cache_nodes:
-
-            out_path = cachenode_app.get_output_path(node)
-
-            self.logger.debug("out_path is %s" % (out_path))
-
-            if not os.path.exists(out_path):
-                self.logger.warning("out_path was not validated.")
-                continue
-
-            self.logger.info("Processing sgtk_cache node: %s" % (node.path(),))
-
-            # allow the base class to collect and create the item. it
-            # should know how to handle the output path
-            item = super(HoudiniSessionCollector, self)._collect_file(
-                parent_item, out_path, frame_sequence=True
-            )
-
-            # the item has been created. update the display name to
-            # include the node path to make it clear to the user how it
-            # was collected within the current session.
-            item.name = "%s (%s)" % (item.name, node.path())
-
-            if work_template:
-                item.properties["work_template"] = work_template
-                self.logger.info("Set work_template property on %s" % (node))
-            else:
-                self.logger.warning(
-                    "Could not set work_template property. Will start versioning at 1."
-                )
-
-            if publish_template:
-                item.properties["publish_template"] = publish_template
-                self.logger.info("Set publish_template property on %s" % (node))
-            else:
-                self.logger.warning(
-                    "Could not set publish_template property. Will use working template as output."
-                )
+        self._collect_tk_nodes("cache", parent_item)
 
     def collect_tk_alembicnodes(self, parent_item):
         """
@@ -274,57 +328,7 @@ class HoudiniSessionCollector(HookBaseClass):
         item for each one with an output on disk.
         :param parent_item: The item to parent new items to.
         """
-
-        publisher = self.parent
-        engine = publisher.engine
-
-        alembicnode_app = engine.apps.get("tk-houdini-alembicnode")
-        if not alembicnode_app:
-            self.logger.debug(
-                "The tk-houdini-alembicnode app is not installed. "
-                "Will not attempt to collect those nodes."
-            )
-            return
-
-        try:
-            tk_alembic_nodes = alembicnode_app.get_nodes()
-        except AttributeError:
-            self.logger.warning(
-                "Unable to query the session for tk-houdini-alembicnode "
-                "instances. It looks like perhaps an older version of the "
-                "app is in use which does not support querying the nodes. "
-                "Consider updating the app to allow publishing their outputs."
-            )
-            return
-
-        # retrieve the work file template defined by the app. we'll set this
-        # on the collected alembicnode items for use during publishing.
-        work_template = alembicnode_app.get_work_file_template()
-
-        for node in tk_alembic_nodes:
-
-            out_path = alembicnode_app.get_output_path(node)
-
-            if not os.path.exists(out_path):
-                continue
-
-            self.logger.info("Processing sgtk_alembic node: %s" % (node.path(),))
-
-            # allow the base class to collect and create the item. it
-            # should know how to handle the output path
-            item = super(HoudiniSessionCollector, self)._collect_file(
-                parent_item, out_path
-            )
-
-            # the item has been created. update the display name to
-            # include the node path to make it clear to the user how it
-            # was collected within the current session.
-            item.name = "%s (%s)" % (item.name, node.path())
-
-            if work_template:
-                item.properties["work_template"] = work_template
-
-            self._alembic_nodes_collected = True
+        self._collect_tk_nodes("alembic", parent_item)
 
     def collect_tk_mantranodes(self, parent_item):
         """
@@ -333,57 +337,99 @@ class HoudiniSessionCollector(HookBaseClass):
         item for each one with an output on disk.
         :param parent_item: The item to parent new items to.
         """
+        self._collect_tk_nodes("mantra", parent_item)
+
+    def _collect_tk_nodes(self, kind, parent_item):
+        """
+        Checks for an installed tk node app of the supplied kind. If installed,
+        will search for instances of the node in the current session and create
+        an item for each one with an output on disk.
+        :param str kind: One of the keys of ``_TK_NODE_SPECS``.
+        :param parent_item: The item to parent new items to.
+        """
+
+        spec = _TK_NODE_SPECS[kind]
 
         publisher = self.parent
         engine = publisher.engine
 
-        mantranode_app = engine.apps.get("tk-houdini-mantranode")
-        if not mantranode_app:
+        app_name = spec["app"]
+        app = engine.apps.get(app_name)
+        if not app:
             self.logger.debug(
-                "The tk-houdini-mantranode app is not installed. "
-                "Will not attempt to collect those nodes."
+                "The %s app is not installed. "
+                "Will not attempt to collect those nodes.",
+                app_name,
             )
             return
 
         try:
-            tk_mantra_nodes = mantranode_app.get_nodes()
+            tk_nodes = app.get_nodes()
         except AttributeError:
             self.logger.warning(
-                "Unable to query the session for tk-houdini-mantranode "
+                "Unable to query the session for %s "
                 "instances. It looks like perhaps an older version of the "
                 "app is in use which does not support querying the nodes. "
-                "Consider updating the app to allow publishing their outputs."
+                "Consider updating the app to allow publishing their outputs.",
+                app_name,
             )
             return
 
-        # retrieve the work file template defined by the app. we'll set this
-        # on the collected alembicnode items for use during publishing.
-        work_template = mantranode_app.get_work_file_template()
+        # retrieve the templates defined by the app. we'll set these on the
+        # collected items for use during publishing. they are only looked up
+        # once the first node with an output on disk is found.
+        work_template = _Lazy(app.get_work_file_template)
+        publish_template = _Lazy(app.get_publish_file_template)
+
+        log_template_properties = spec["log_template_properties"]
+
+        collect_file = super(HoudiniSessionCollector, self)._collect_file
+
+        for node in tk_nodes:
 
-        for node in tk_mantra_nodes:
+            out_path = app.get_output_path(node)
 
-            out_path = mantranode_app.get_output_path(node)
+            self.logger.debug("out_path is %s", out_path)
 
-            if not os.path.exists(out_path):
+            if not self._path_exists(out_path):
+                if spec["warn_missing_output"]:
+                    self.logger.warning("out_path was not validated.")
                 continue
 
-            self.logger.info("Processing sgtk_mantra node: %s" % (node.path(),))
+            node_path = node.path()
+            self.logger.info("Processing %s node: %s", spec["node_label"], node_path)
 
             # allow the base class to collect and create the item. it
             # should know how to handle the output path
-            item = super(HoudiniSessionCollector, self)._collect_file(
-                parent_item, out_path, frame_sequence=True
+            item = collect_file(
+                parent_item, out_path, frame_sequence=spec["frame_sequence"]
             )
 
             # the item has been created. update the display name to
             # include the node path to make it clear to the user how it
             # was collected within the current session.
-            item.name = "%s (%s)" % (item.name, node.path())
+            item.name = "%s (%s)" % (item.name, node_path)
 
-            if work_template:
-                item.properties["work_template"] = work_template
+            if work_template():
+                item.properties["work_template"] = work_template()
+                if log_template_properties:
+                    self.logger.info("Set work_template property on %s", node)
+            elif log_template_properties:
+                self.logger.warning(
+                    "Could not set work_template property. Will start versioning at 1."
+                )
+
+            if spec["set_publish_template"]:
+                if publish_template():
+                    item.properties["publish_template"] = publish_template()
+                    if log_template_properties:
+                        self.logger.info("Set publish_template property on %s", node)
+                elif log_template_properties:
+                    self.logger.warning(
+                        "Could not set publish_template property. Will use working template as output."
+                    )
 
-            self._mantra_nodes_collected = True
+            self._collected_kinds.add(kind)
 
     def collect_tk_arnoldnodes(self, parent_item):
         # check if arnold app is installed and get all written-to-disk outputs
@@ -405,70 +451,140 @@ class HoudiniSessionCollector(HookBaseClass):
         except:
             self.logger.error("Could not receive arnold node instances.")
 
-        work_template = app.getWorkFileTemplate()
+        work_template = _Lazy(app.getWorkFileTemplate)
+
+        collect_file = super(HoudiniSessionCollector, self)._collect_file
 
         # run collection on every node instance found
         for node in nodes:
 
             out_path = app.handler.getOutputPath(node)
 
-            if not os.path.exists(out_path):
+            if not self._path_exists(out_path):
                 continue
 
-            self.logger.info("Processing sgtk_arnold node: %s" % node.path())
+            node_path = node.path()
+            self.logger.info("Processing sgtk_arnold node: %s", node_path)
 
             # create the actual sub-item
-            item = super(HoudiniSessionCollector, self)._collect_file(
-                parent_item, out_path, frame_sequence=True
-            )
+            item = collect_file(parent_item, out_path, frame_sequence=True)
 
             # item created, update gui
-            item.name = "Beauty Render (%s)" % (node.path())
+            item.name = "Beauty Render (%s)" % (node_path)
 
             # update item with work_template for later fields use
-            if work_template:
-                item.properties["work_template"] = work_template
-
-            self.logger.info(
-                "Setting publish name to %s"
-                % (publisher.util.get_publish_name(out_path, sequence=True))
-            )
+            if work_template():
+                item.properties["work_template"] = work_template()
+
+            # only resolve the publish name if it is going to be logged
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(
+                    "Setting publish name to %s",
+                    publisher.util.get_publish_name(out_path, sequence=True),
+                )
 
             # run for aovs
             self.__collect_tk_arnoldaovs(node, item, app, work_template)
 
-            self._arnold_nodes_collected = True
+            self._collected_kinds.add("arnold")
 
     def __collect_tk_arnoldaovs(self, node, parent_item, app, work_template):
         # creates items for every enabled aov
-        publisher = self.parent
 
         # get aov enable parameters
         parms = app.handler.getDifferentFileAOVs(node)
         aovs = {}
 
         for parm in parms:
+            # only look up the label and file of enabled aovs. evaluating
+            # through the node avoids creating intermediate parm objects
+            if not parm.eval():
+                continue
             parmNumber = parm.name().replace("ar_aov_separate", "")
-            if parm.eval():
-                aovName = node.parm("ar_aov_label%s" % (parmNumber)).eval()
-                aovs[aovName] = node.parm("ar_aov_separate_file%s" % parmNumber).eval()
+            aovName = node.evalParm("ar_aov_label%s" % (parmNumber))
+            aovs[aovName] = node.evalParm("ar_aov_separate_file%s" % parmNumber)
+
+        # find the output directories shared by several aov files. aovs alone
+        # in their directory, e.g. one frame directory per aov, are cheaper to
+        # stat than to list
+        dir_files = {}
+        for aov_path in aovs.values():
+            aov_dir, aov_file = os.path.split(os.path.normcase(aov_path))
+            dir_files.setdefault(aov_dir, set()).add(aov_file)
+
+        collect_file = super(HoudiniSessionCollector, self)._collect_file
+
+        # several aovs may be written to the same file. only collect each
+        # file once
+        collected_paths = set()
 
         for aov in aovs.items():
-            if not os.path.exists(aov[1]):
+            aov_path = os.path.normcase(aov[1])
+            if aov_path in collected_paths:
+                # only query the node path if it is going to be logged
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(
+                        "Skipping %s aov of %s, its output %s was already collected.",
+                        aov[0],
+                        node.path(),
+                        aov[1],
+                    )
                 continue
 
-            item = super(HoudiniSessionCollector, self)._collect_file(
-                parent_item, aov[1], frame_sequence=True
-            )
+            # aovs sharing an output directory are checked against a single
+            # listing of that directory instead of stat-ing every aov file
+            aov_dir = os.path.dirname(aov_path)
+            if len(dir_files[aov_dir]) > 1 or aov_dir in self._dir_listings:
+                # confirm misses with a stat, the listed name may differ in
+                # case or unicode form from the parm value
+                exists = _exists_in_listing(
+                    aov[1], self._dir_listings
+                ) or self._path_exists(aov[1])
+            else:
+                exists = self._path_exists(aov[1])
+            if not exists:
+                continue
+
+            collected_paths.add(aov_path)
+
+            item = collect_file(parent_item, aov[1], frame_sequence=True)
 
             # sub-item created, update gui
             item.name = "%s AOV Render" % (aov[0])
 
             # add worktemplate to every subitem
-            if work_template:
-                item.properties["work_template"] = work_template
+            if work_template():
+                item.properties["work_template"] = work_template()
 
-            self.logger.info(
-                "Setting publish name to %s"
-                % (publisher.util.get_publish_name(aov[1], sequence=True))
-            )
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(
+                    "Setting publish name to %s",
+                    self.parent.util.get_publish_name(aov[1], sequence=True),
+                )
+
+    def _reset_collection_state(self):
+        """
+        Resets the state tracked while collecting the session.
+        """
+        # remember which kinds of tk nodes were collected
+        self._collected_kinds = set()
+
+        # existence of the output paths checked during this collection
+        self._exists_cache = {}
+
+        # render output directory listings read during this collection
+        self._dir_listings = {}
+
+    def _path_exists(self, path):
+        """
+        Returns whether the supplied path exists. Results are cached for the
+        duration of the collection so outputs shared by several nodes are only
+        checked once.
+        :param str path: The path to check.
+        :returns: True if the path exists, False otherwise.
+        """
+        exists = self._exists_cache.get(path)
+        if exists is None:
+            exists = _stat_or_none(path) is not None
+            self._exists_cache[path] = exists
+        return exists